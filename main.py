@@ -1,103 +1,708 @@
 # PDF Comparator 3.0
 # A program for comparing the textual content of PDF files
 import difflib
+import hashlib
+import io
+import json
+import multiprocessing
 import os
 import sys
+import time
 
 from pathlib import Path
+from queue import Empty
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-                              QLabel, QLineEdit, QPushButton, QTextEdit, QProgressBar,
-                              QFileDialog, QMessageBox, QGroupBox)
-from PySide6.QtCore import Qt, QThread, Signal, QObject
-from PyPDF2 import PdfReader
-from pdfminer.high_level import extract_text as pdfminer_extract
+                              QLabel, QLineEdit, QPushButton, QListView, QProgressBar,
+                              QFileDialog, QMessageBox, QGroupBox, QAbstractItemView)
+from PySide6.QtCore import Qt, QTimer, Signal, QObject, QAbstractListModel, QModelIndex
+from PySide6.QtGui import QColor, QFont, QFontDatabase, QKeySequence, QShortcut
+import pymupdf
+
+CACHE_DIR = Path.home() / ".cache" / "pdf-comparator"
+# Part of the cached pages file name, bump it whenever the extracted text changes
+CACHE_VERSION = 2
+# Cache files unused for longer than this are removed, and the oldest ones
+# are removed while the cache is bigger than CACHE_MAX_SIZE bytes
+CACHE_MAX_AGE = 30 * 24 * 60 * 60
+CACHE_MAX_SIZE = 500 * 1024 * 1024
+# Diff results are sent to the window in chunks of about this many lines
+CHUNK_LINES = 500
+# Extraction progress is sent at most this often, in seconds
+PROGRESS_INTERVAL = 0.05
+# Replaced blocks are aligned line by line only up to this size (lines1 x lines2)
+# and this cost (chars1 x chars2, about a quarter of a second)
+MAX_ALIGN_CELLS = 250_000
+MAX_ALIGN_CHARS = 10_000_000_000
+# Minimal similarity (0-100) for two lines to be shown as a changed pair
+ALIGN_CUTOFF = 75
+
+# Colors of the diff result lines, the summary lines have no color and are bold
+GRAY = "gray"
+RED = "red"
+GREEN = "green"
+
+
+def extract_pages(pdf_path, report_progress):
+    # Returns the text of every page, report_progress(done, total) is called before every page
+    try:
+        # Try PyMuPDF first, it is much faster than pdfminer
+        # Progress stays at zero until some text is found, otherwise it would
+        # start over when pdfminer has to read the whole file again
+        pages = []
+        found_text = False
+        with pymupdf.open(pdf_path) as doc:
+            for i, page in enumerate(doc):
+                if found_text:
+                    report_progress(i, doc.page_count)
+                pages.append(page.get_text("text"))
+                found_text = found_text or bool(pages[-1].strip())
+        if found_text:
+            return pages
+
+        # PyMuPDF found no text, let pdfminer have a try
+        return pdfminer_pages(pdf_path, report_progress)
+    except Exception as e:
+        # Fall back to pypdf if PyMuPDF and pdfminer fail
+        try:
+            from pypdf import PdfReader
+
+            reader = PdfReader(pdf_path)
+            pages = []
+            for i, page in enumerate(reader.pages):
+                report_progress(i, len(reader.pages))
+                pages.append(page.extract_text() or "")
+            return pages
+        except Exception as e2:
+            raise Exception(f"Ошибка извлечения текста: {str(e2)}")
+
+
+def pdfminer_pages(pdf_path, report_progress):
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+
+    # boxes_flow=None skips the grouping of text boxes into columns, which is
+    # the slowest part of the layout analysis and isn't needed for a diff.
+    # Without LAParams at all pdfminer wouldn't split the text into lines.
+    resources = PDFResourceManager(caching=True)
+    output = io.StringIO()
+    device = TextConverter(resources, output, laparams=LAParams(boxes_flow=None))
+    interpreter = PDFPageInterpreter(resources, device)
+    pages = []
+    with open(pdf_path, "rb") as f:
+        pdf_pages = list(PDFPage.get_pages(f, caching=True))
+        for i, page in enumerate(pdf_pages):
+            report_progress(i, len(pdf_pages))
+            interpreter.process_page(page)
+            # Every page is terminated with a form feed
+            pages.append(output.getvalue().removesuffix("\f"))
+            output.seek(0)
+            output.truncate()
+    device.close()
+    return pages
+
+
+def file_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_cache_file(path, text):
+    # Write to a temporary file first so a reader never sees a partial file
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def content_hash(pdf_path):
+    # The hash is remembered per path, size and mtime, so unchanged files
+    # don't have to be read and hashed again
+    stat = os.stat(pdf_path)
+    stat_key = f"{os.path.abspath(pdf_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    stat_file = CACHE_DIR / f"{hashlib.blake2b(stat_key.encode(), digest_size=16).hexdigest()}.hash"
+    try:
+        digest = stat_file.read_text(encoding="utf-8")
+        # Keeps the file from being pruned while the PDF is still in use
+        os.utime(stat_file)
+        return digest
+    except OSError:
+        pass
+
+    digest = file_hash(pdf_path)
+    try:
+        write_cache_file(stat_file, digest)
+    except OSError:
+        pass
+    return digest
+
+
+def cache_path(pdf_path):
+    return CACHE_DIR / f"{content_hash(pdf_path)}.v{CACHE_VERSION}.json"
+
+
+def prune_cache():
+    # The modification time of a cache file is refreshed on every use,
+    # so the least recently used files go first
+    now = time.time()
+    entries = []
+    for path in CACHE_DIR.iterdir():
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        # Pages of other cache versions can't be used anymore
+        obsolete = path.suffix == ".json" and not path.name.endswith(f".v{CACHE_VERSION}.json")
+        if obsolete or now - stat.st_mtime > CACHE_MAX_AGE:
+            path.unlink(missing_ok=True)
+        else:
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    size = sum(entry[1] for entry in entries)
+    for _, file_size, path in sorted(entries):
+        if size <= CACHE_MAX_SIZE:
+            break
+        path.unlink(missing_ok=True)
+        size -= file_size
+
+
+def extract_cached_pages(pdf_path, report_progress):
+    try:
+        pages_file = cache_path(pdf_path)
+        if pages_file.exists():
+            with open(pages_file, encoding="utf-8") as f:
+                pages = json.load(f)
+            try:
+                os.utime(pages_file)
+            except OSError:
+                pass
+            return pages
+    except (OSError, ValueError):
+        # The cache is only an optimization, extract without it
+        return extract_pages(pdf_path, report_progress)
+
+    pages = extract_pages(pdf_path, report_progress)
+    try:
+        write_cache_file(pages_file, json.dumps(pages, ensure_ascii=False))
+    except (OSError, ValueError):
+        pass
+    return pages
+
+
+class ProgressReporter:
+    # Sends the extraction progress of one file, but only when the percentage
+    # grew and not more often than every PROGRESS_INTERVAL seconds. A fallback
+    # extractor starts from the first page again, which doesn't move it back.
+    def __init__(self, messages, job_id, index):
+        self.messages = messages
+        self.job_id = job_id
+        self.index = index
+        self._last_percent = -1
+        self._last_time = 0.0
+
+    def __call__(self, done, total):
+        percent = done * 100 // total
+        now = time.monotonic()
+        if percent <= self._last_percent or now - self._last_time < PROGRESS_INTERVAL:
+            return
+        self._last_percent = percent
+        self._last_time = now
+        self.messages.put((self.job_id, 'extract_progress', (self.index, percent / 100)))
 
 
-class Worker(QObject):
-    progress_updated = Signal(int)
-    status_updated = Signal(str)
-    result_ready = Signal(str)
-    error_occurred = Signal(str)
-    finished = Signal()
+def extract_process(index, jobs, messages, results):
+    # Extracts files next to the comparison process and hands the pages to it.
+    # The process is kept between comparisons and waits for the next job.
+    for job_id, pdf_path in iter(jobs.get, None):
+        try:
+            pages = extract_cached_pages(pdf_path, ProgressReporter(messages, job_id, index))
+            results.put((job_id, 'pages', pages))
+            messages.put((job_id, 'extract_progress', (index, 1.0)))
+        except Exception as e:
+            results.put((job_id, 'error', str(e)))
 
-    def __init__(self, file1, file2):
-        super().__init__()
+
+def compare_process(jobs, helper_jobs, messages, results):
+    for job_id, file1, file2 in iter(jobs.get, None):
+        Comparison(job_id, file1, file2, helper_jobs, messages, results).run()
+        # Once per comparison, after both files have been cached
+        try:
+            prune_cache()
+        except OSError:
+            pass
+
+
+class Comparison:
+    # Runs in a child process and reports everything as (job_id, kind, payload) messages.
+    # The diff is sent as chunks of (text, color) lines, formatting is left to the window.
+    # The pages of the second file come from extract_process through results.
+    def __init__(self, job_id, file1, file2, helper_jobs, messages, results):
+        self.job_id = job_id
         self.file1 = file1
         self.file2 = file2
-        self._is_running = True
+        self.helper_jobs = helper_jobs
+        self.messages = messages
+        self.results = results
+        self._helper_busy = False
+        self._align_missing = False
+        self._chunk = []
 
     def run(self):
         try:
-            self.status_updated.emit(f"Извлечение текста из {Path(self.file1).name}...")
-            text1 = self.extract_text(self.file1)
-            if not self._is_running:
+            # Byte-identical files need neither extraction nor diff
+            if self.files_identical():
+                self.send('result', "Файлы идентичны. Итого: 0 добавлений, 0 удалений")
+                self.send('progress', 100)
+                self.send('status', "Сравнение завершено. Файлы идентичны.")
                 return
 
-            self.progress_updated.emit(30)
-            self.status_updated.emit(f"Извлечение текста из {Path(self.file2).name}...")
-            text2 = self.extract_text(self.file2)
-            if not self._is_running:
-                return
+            self.send('status',
+                f"Извлечение текста из {Path(self.file1).name} и {Path(self.file2).name}...")
+            # The second file is extracted by the helper in parallel with the first
+            self.helper_jobs.put((self.job_id, self.file2))
+            self._helper_busy = True
+            pages1 = extract_cached_pages(self.file1, ProgressReporter(self.messages, self.job_id, 0))
+            self.send('extract_progress', (0, 1.0))
+            # The helper may still send pages of a job that failed after it had finished
+            job_id, kind, payload = self.results.get()
+            while job_id != self.job_id:
+                job_id, kind, payload = self.results.get()
+            self._helper_busy = False
+            if kind == 'error':
+                raise Exception(payload)
+            pages2 = payload
+
+            self.send('progress', 60)
+            self.send('status', "Сравнение текстов...")
+
+            # Opcodes are formatted as they are produced, nothing is collected
+            lines1, lines2, opcodes = self.diff_pages(pages1, pages2)
 
-            self.progress_updated.emit(60)
-            self.status_updated.emit("Сравнение текстов...")
+            added = removed = 0
+            progress = 60
+            for tag, i1, i2, j1, j2 in opcodes:
+                if 60 + 40 * i2 // max(len(lines1), 1) > progress:
+                    progress = 60 + 40 * i2 // max(len(lines1), 1)
+                    self.send('progress', progress)
+
+                if tag == 'replace':
+                    steps = self.align_replace(lines1, lines2, i1, i2, j1, j2)
+                else:
+                    steps = [(tag, i1, i2, j1, j2)]
+                # A replaced block is shown as removed lines followed by added ones
+                for tag, i1, i2, j1, j2 in steps:
+                    if tag == 'equal':
+                        self.add_block(GRAY, "  ", lines1[i1:i2])
+                        continue
+                    removed += i2 - i1
+                    added += j2 - j1
+                    if tag in ('delete', 'replace'):
+                        self.add_block(RED, "- ", lines1[i1:i2])
+                    if tag in ('insert', 'replace'):
+                        self.add_block(GREEN, "+ ", lines2[j1:j2])
+            self.flush_chunk()
+
+            summary = f"Итого: {added} добавлений, {removed} удалений"
+            if self._align_missing:
+                summary += " (rapidfuzz не установлен, измененные строки не сопоставлены)"
+            self.send('result', summary)
+            self.send('progress', 100)
+            self.send('status', f"Сравнение завершено. {len(lines1)} к {len(lines2)} строк.")
 
-            lines1 = text1.splitlines()
-            lines2 = text2.splitlines()
+        except Exception as e:
+            self.send('error', f"Ошибка: {str(e)}")
+        finally:
+            # Tells the window whether the helper is still busy with this job
+            self.send('finished', self._helper_busy)
+
+    def send(self, kind, payload):
+        self.messages.put((self.job_id, kind, payload))
+
+    def files_identical(self):
+        if os.path.getsize(self.file1) != os.path.getsize(self.file2):
+            return False
+        return content_hash(self.file1) == content_hash(self.file2)
+
+    def add_block(self, color, prefix, lines):
+        for start in range(0, len(lines), CHUNK_LINES):
+            self._chunk.extend((prefix + line, color) for line in lines[start:start + CHUNK_LINES])
+            if len(self._chunk) >= CHUNK_LINES:
+                self.flush_chunk()
+
+    def flush_chunk(self):
+        if self._chunk:
+            self.send('chunk', self._chunk)
+        self._chunk = []
+
+    def align_replace(self, lines1, lines2, i1, i2, j1, j2):
+        # Splits a replaced block into pairs of similar lines, so that a changed
+        # line is shown right next to its new version. This is what
+        # Differ._fancy_replace does, but rapidfuzz scores all pairs at once in C++.
+        try:
+            import numpy
+            from rapidfuzz import fuzz, process
+        except ImportError:
+            self._align_missing = True
+            return [('replace', i1, i2, j1, j2)]
+        if (i2 - i1) * (j2 - j1) > MAX_ALIGN_CELLS:
+            return [('replace', i1, i2, j1, j2)]
+        # Scoring a pair of lines takes time proportional to both lengths
+        chars1 = sum(len(line) for line in lines1[i1:i2])
+        chars2 = sum(len(line) for line in lines2[j1:j2])
+        if chars1 * chars2 > MAX_ALIGN_CHARS:
+            return [('replace', i1, i2, j1, j2)]
+
+        scores = process.cdist(lines1[i1:i2], lines2[j1:j2], scorer=fuzz.ratio,
+                               dtype=numpy.uint8, score_cutoff=ALIGN_CUTOFF)
+
+        # The best pair splits the block in two, both parts are aligned the same way.
+        # A stack is used instead of recursion, ranges are relative to the block.
+        steps = []
+        stack = [(0, i2 - i1, 0, j2 - j1)]
+        while stack:
+            item = stack.pop()
+            if len(item) == 2:
+                # A line found on both sides is unchanged, not a changed pair
+                a, b = item
+                tag = 'equal' if lines1[i1 + a] == lines2[j1 + b] else 'replace'
+                steps.append((tag, i1 + a, i1 + a + 1, j1 + b, j1 + b + 1))
+                continue
+
+            a1, a2, b1, b2 = item
+            if a1 < a2 and b1 < b2:
+                block = scores[a1:a2, b1:b2]
+                a, b = divmod(int(block.argmax()), b2 - b1)
+                if block[a, b]:
+                    a += a1
+                    b += b1
+                    stack.append((a + 1, a2, b + 1, b2))
+                    stack.append((a, b))
+                    stack.append((a1, a, b1, b))
+                    continue
+            if a1 < a2:
+                steps.append(('delete', i1 + a1, i1 + a2, j1 + b1, j1 + b1))
+            if b1 < b2:
+                steps.append(('insert', i1 + a2, i1 + a2, j1 + b1, j1 + b2))
+        return steps
+
+    def diff_pages(self, pages1, pages2):
+        # Equal pages are not diffed, only runs of changed pages are.
+        # Returns the lines of both documents and a generator of opcodes over
+        # them, so the first pages can be shown while later ones are diffed.
+        lines1 = []
+        lines2 = []
+        starts1 = [0]
+        starts2 = [0]
+        for page in pages1:
+            lines1.extend(page.splitlines())
+            starts1.append(len(lines1))
+        for page in pages2:
+            lines2.extend(page.splitlines())
+            starts2.append(len(lines2))
+        return lines1, lines2, self.iter_page_opcodes(pages1, pages2, lines1, lines2, starts1, starts2)
+
+    def iter_page_opcodes(self, pages1, pages2, lines1, lines2, starts1, starts2):
+        # Pages can't be matched up if their number changed too much
+        count1, count2 = len(pages1), len(pages2)
+        if abs(count1 - count2) > max(count1, count2) / 2:
+            yield from self.diff_lines(lines1, lines2)
+            return
 
-            differ = difflib.Differ()
-            diff = list(differ.compare(lines1, lines2))
+        def diff(i1, i2, j1, j2):
+            for tag, a1, a2, b1, b2 in self.diff_lines(lines1[i1:i2], lines2[j1:j2]):
+                yield (tag, i1 + a1, i1 + a2, j1 + b1, j1 + b2)
+
+        common = min(count1, count2)
+        page = 0
+        while page < common:
+            if pages1[page] == pages2[page]:
+                yield ('equal', starts1[page], starts1[page + 1], starts2[page], starts2[page + 1])
+                page += 1
+                continue
+
+            start = page
+            while page < common and pages1[page] != pages2[page]:
+                page += 1
+            if page < common:
+                yield from diff(starts1[start], starts1[page], starts2[start], starts2[page])
+            else:
+                # The changed run reaches the end, diff it together with extra pages
+                yield from diff(starts1[start], starts1[-1], starts2[start], starts2[-1])
+                return
 
-            self.progress_updated.emit(80)
-            self.status_updated.emit("Форматирование результатов...")
+        # Pages left over in the longer document
+        yield from diff(starts1[common], starts1[-1], starts2[common], starts2[-1])
+
+    def diff_lines(self, lines1, lines2):
+        # Returns SequenceMatcher-style opcodes (tag, i1, i2, j1, j2).
+        # Like GNU diff, leading and trailing lines that are equal in both
+        # texts are cut off first and only the middle part is diffed.
+        limit = min(len(lines1), len(lines2))
+        start = 0
+        while start < limit and lines1[start] == lines2[start]:
+            start += 1
+        end = 0
+        while end < limit - start and lines1[-1 - end] == lines2[-1 - end]:
+            end += 1
+        stop1 = len(lines1) - end
+        stop2 = len(lines2) - end
+
+        opcodes = []
+        if start:
+            opcodes.append(('equal', 0, start, 0, start))
+        for tag, i1, i2, j1, j2 in self.diff_changed_lines(lines1[start:stop1], lines2[start:stop2]):
+            opcodes.append((tag, start + i1, start + i2, start + j1, start + j2))
+        if end:
+            opcodes.append(('equal', stop1, len(lines1), stop2, len(lines2)))
+        return opcodes
+
+    def diff_changed_lines(self, lines1, lines2):
+        try:
+            from diff_match_patch import diff_match_patch
+        except ImportError:
+            # Fall back to SequenceMatcher if diff-match-patch is not installed
+            return self.match_lines(lines1, lines2)
+
+        # Line-mode diff: every line is encoded as a single char
+        dmp = diff_match_patch()
+        dmp.Diff_Timeout = 5.0
+        chars1, chars2, line_array = dmp.diff_linesToChars(
+            "".join(line + "\n" for line in lines1),
+            "".join(line + "\n" for line in lines2))
+        # On timeout what is left is returned as one coarse replacement, which is
+        # still a valid diff and keeps pathological inputs from running for minutes
+        diffs = dmp.diff_main(chars1, chars2, False)
+        # Semantic cleanup would merge unchanged lines between nearby edits into
+        # them, as every line is a single char here. Only merge adjacent edits,
+        # before decoding so the diff stays aligned to whole lines.
+        dmp.diff_cleanupMerge(diffs)
+        dmp.diff_charsToLines(diffs, line_array)
+
+        opcodes = []
+        i = j = 0
+        for op, data in diffs:
+            count = data.count("\n")
+            if op == diff_match_patch.DIFF_EQUAL:
+                opcodes.append(('equal', i, i + count, j, j + count))
+                i += count
+                j += count
+                continue
+
+            if op == diff_match_patch.DIFF_DELETE:
+                opcode = ('delete', i, i + count, j, j)
+                i += count
+            else:
+                opcode = ('insert', i, i, j, j + count)
+                j += count
+
+            # Adjacent deletion and insertion form a replacement
+            if opcodes and opcodes[-1][0] in ('delete', 'insert') and opcodes[-1][0] != opcode[0]:
+                prev = opcodes.pop()
+                opcode = ('replace', prev[1], opcode[2], prev[3], opcode[4])
+            opcodes.append(opcode)
+        return opcodes
+
+    def match_lines(self, lines1, lines2):
+        # Prefer the C implementation from cdifflib when available
+        try:
+            from cdifflib import CSequenceMatcher as SequenceMatcher
+        except ImportError:
+            SequenceMatcher = difflib.SequenceMatcher
+        matcher = SequenceMatcher(None, lines1, lines2, autojunk=False)
+        return matcher.get_opcodes()
 
-            result = []
-            added = removed = 0
-            for line in diff:
-                if not self._is_running:
-                    return
-
-                if line.startswith('- '):
-                    result.append(f'<span style="color:red">{line}</span>')
-                    removed += 1
-                elif line.startswith('+ '):
-                    result.append(f'<span style="color:green">{line}</span>')
-                    added += 1
-                elif not line.startswith('? '):
-                    result.append(f'<span style="color:gray">{line}</span>')
-
-            result.append(f"\n<b>Итого: {added} добавлений, {removed} удалений</b>")
-            self.result_ready.emit("<br>".join(result))
-            self.progress_updated.emit(100)
-            self.status_updated.emit(f"Сравнение завершено. {len(lines1)} к {len(lines2)} строк.")
 
-        except Exception as e:
-            self.error_occurred.emit(f"Ошибка: {str(e)}")
-        finally:
-            self.finished.emit()
+class Worker(QObject):
+    # Runs the comparison in child processes and turns their messages into signals.
+    # PyMuPDF can't be used from several threads and the diff holds the GIL,
+    # so processes keep the window responsive and can be cancelled at once.
+    progress_updated = Signal(int)
+    status_updated = Signal(str)
+    chunk_ready = Signal(list)
+    result_ready = Signal(str)
+    error_occurred = Signal(str)
+    finished = Signal()
 
-    def extract_text(self, pdf_path):
+    def __init__(self):
+        super().__init__()
+        self.processes = []
+        self.jobs = []
+        self.messages = None
+        self.results = None
+        self.job_id = 0
+        self._polling = False
+        self._last_progress = None
+        self._last_status = None
+        # Each file reports into its own 30% of the progress bar
+        self.fractions = [0.0, 0.0]
+        self.timer = QTimer(self)
+        self.timer.setInterval(50)
+        self.timer.timeout.connect(self.poll)
+
+    def start_processes(self):
+        # Spawning a process and importing PyMuPDF takes a noticeable time, so the
+        # processes are started once and reused until one of them dies or is cancelled
+        if self.processes and all(process.is_alive() for process in self.processes):
+            return
+        self.terminate_processes()
+        # The second file is extracted by a helper process in parallel with the first
+        context = multiprocessing.get_context("spawn")
+        self.messages = context.Queue()
+        self.results = context.Queue()
+        self.jobs = [context.Queue(), context.Queue()]
+        self.processes = [
+            context.Process(target=compare_process,
+                            args=(self.jobs[0], self.jobs[1], self.messages, self.results),
+                            daemon=True),
+            context.Process(target=extract_process,
+                            args=(1, self.jobs[1], self.messages, self.results), daemon=True),
+        ]
+        for process in self.processes:
+            process.start()
+
+    def terminate_processes(self):
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        self.processes = []
+
+    def start(self, file1, file2):
+        self.start_processes()
+        self.job_id += 1
+        self.fractions = [0.0, 0.0]
+        self._last_progress = None
+        self._last_status = None
+        self.jobs[0].put((self.job_id, file1, file2))
+        self.timer.start()
+
+    def is_running(self):
+        return self.timer.isActive()
+
+    def poll(self):
+        # An error message box runs its own event loop, don't read messages from inside it
+        if self._polling:
+            return
+        self._polling = True
         try:
-            # Try pdfminer first for better extraction
-            text = pdfminer_extract(pdf_path)
-            return text
-        except Exception as e:
-            # Fall back to PyPDF2 if pdfminer fails
+            self.read_messages()
+        finally:
+            self._polling = False
+
+    def read_messages(self):
+        # Exit codes are taken before reading, so messages sent right before a crash are still handled
+        exitcodes = [process.exitcode for process in self.processes]
+
+        # Don't block the window for too long if a lot of results arrived at once
+        deadline = time.monotonic() + 0.05
+        while True:
+            if time.monotonic() > deadline:
+                return
             try:
-                reader = PdfReader(pdf_path)
-                text = ""
-                for i, page in enumerate(reader.pages):
-                    if not self._is_running:
-                        return ""
-                    progress = 10 + (i * 40 // len(reader.pages))
-                    self.progress_updated.emit(progress)
-                    text += page.extract_text() or ""
-                return text
-            except Exception as e2:
-                raise Exception(f"Ошибка извлечения текста: {str(e2)}")
+                job_id, kind, payload = self.messages.get_nowait()
+            except Empty:
+                break
+            # Left over from a comparison that already ended
+            if job_id != self.job_id:
+                continue
+
+            if kind == 'finished':
+                # A file nobody waits for anymore would hold up the next comparison,
+                # the processes are started again by it
+                if payload:
+                    self.terminate_processes()
+                self.finish()
+                return
+            if kind == 'extract_progress':
+                index, fraction = payload
+                self.fractions[index] = fraction
+                self.set_progress(int(30 * sum(self.fractions)))
+            elif kind == 'progress':
+                self.set_progress(payload)
+            elif kind == 'status':
+                self.set_status(payload)
+            else:
+                signal = {
+                    'chunk': self.chunk_ready,
+                    'result': self.result_ready,
+                    'error': self.error_occurred,
+                }[kind]
+                signal.emit(payload)
+
+        # The helper only matters until it has delivered the pages
+        if exitcodes[0] is not None or (exitcodes[1] is not None and self.fractions[1] < 1.0):
+            self.error_occurred.emit("Ошибка: процесс сравнения завершился аварийно")
+            self.finish()
+
+    def set_progress(self, value):
+        # Repaint the progress bar and the status bar only when something changed
+        if value != self._last_progress:
+            self._last_progress = value
+            self.progress_updated.emit(value)
+
+    def set_status(self, text):
+        if text != self._last_status:
+            self._last_status = text
+            self.status_updated.emit(text)
+
+    def finish(self):
+        self.timer.stop()
+        self.finished.emit()
 
     def stop(self):
-        self._is_running = False
+        # A cancelled comparison can only be interrupted by killing its processes,
+        # they are started again by the next comparison
+        if self.is_running():
+            self.terminate_processes()
+            self.finish()
+
+    def shutdown(self):
+        self.stop()
+        for jobs in self.jobs:
+            jobs.put(None)
+        for process in self.processes:
+            process.join(1)
+        self.terminate_processes()
+
+
+class DiffModel(QAbstractListModel):
+    # Lines of the diff result as (text, color). The view only asks for the
+    # visible rows, so even a huge diff is shown at once and takes no more
+    # memory than the list itself.
+    def __init__(self):
+        super().__init__()
+        self.diff_lines = []
+        self.bold_font = QFont()
+        self.bold_font.setBold(True)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.diff_lines)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        text, color = self.diff_lines[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return text
+        if role == Qt.ItemDataRole.ForegroundRole and color:
+            return QColor(color)
+        if role == Qt.ItemDataRole.FontRole and not color:
+            return self.bold_font
+        return None
+
+    def append_lines(self, lines):
+        start = len(self.diff_lines)
+        self.beginInsertRows(QModelIndex(), start, start + len(lines) - 1)
+        self.diff_lines.extend(lines)
+        self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.diff_lines = []
+        self.endResetModel()
 
 
 class PDFComparator(QMainWindow):
@@ -105,10 +710,19 @@ class PDFComparator(QMainWindow):
         super().__init__()
         self.setWindowTitle("PDF Comparator 3.0    Программа для сравнения текстового содержимого PDF-файлов")
         self.resize(1000, 700)
-        self.worker_thread = None
         self.init_ui()
         self.init_menu()
 
+        # The worker and its processes live as long as the window
+        self.worker = Worker()
+        self.worker.progress_updated.connect(self.update_progress)
+        self.worker.status_updated.connect(self.update_status)
+        self.worker.chunk_ready.connect(self.result_model.append_lines)
+        self.worker.result_ready.connect(self.append_summary)
+        self.worker.error_occurred.connect(self.show_error)
+        self.worker.finished.connect(self.cleanup)
+        self.worker.start_processes()
+
     def init_menu(self):
         menubar = self.menuBar()
         
@@ -201,10 +815,16 @@ class PDFComparator(QMainWindow):
         # Results
         result_group = QGroupBox("Результаты сравнения")
         result_layout = QVBoxLayout()
-        self.result_text = QTextEdit()
-        self.result_text.setReadOnly(True)
-        self.result_text.setAcceptRichText(True)
-        result_layout.addWidget(self.result_text)
+        self.result_model = DiffModel()
+        self.result_view = QListView()
+        self.result_view.setModel(self.result_model)
+        # All rows have the same height, so the view doesn't have to measure them
+        self.result_view.setUniformItemSizes(True)
+        self.result_view.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+        self.result_view.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        copy_shortcut = QShortcut(QKeySequence.StandardKey.Copy, self.result_view)
+        copy_shortcut.activated.connect(self.copy_selection)
+        result_layout.addWidget(self.result_view)
         result_group.setLayout(result_layout)
         main_layout.addWidget(result_group, stretch=1)
 
@@ -237,27 +857,14 @@ class PDFComparator(QMainWindow):
             QMessageBox.critical(self, "Ошибка", "Один или оба файла не существуют")
             return
 
-        self.result_text.clear()
+        self.result_model.clear()
         self.compare_btn.setEnabled(False)
         self.cancel_btn.setEnabled(True)
         self.progress_bar.show()
         self.progress_bar.setValue(0)
         self.status_label.setText("Начато сравнение...")
 
-        # Create worker and thread
-        self.worker_thread = QThread()
-        self.worker = Worker(file1, file2)
-        self.worker.moveToThread(self.worker_thread)
-
-        # Connect signals
-        self.worker.progress_updated.connect(self.update_progress)
-        self.worker.status_updated.connect(self.update_status)
-        self.worker.result_ready.connect(self.show_result)
-        self.worker.error_occurred.connect(self.show_error)
-        self.worker.finished.connect(self.cleanup)
-
-        self.worker_thread.started.connect(self.worker.run)
-        self.worker_thread.start()
+        self.worker.start(file1, file2)
 
     def update_progress(self, value):
         self.progress_bar.setValue(value)
@@ -265,37 +872,36 @@ class PDFComparator(QMainWindow):
     def update_status(self, text):
         self.status_label.setText(text)
 
-    def show_result(self, html_text):
-        self.result_text.setHtml(html_text)
+    def append_summary(self, text):
+        self.result_model.append_lines([(text, None)])
+
+    def copy_selection(self):
+        rows = sorted(index.row() for index in self.result_view.selectedIndexes())
+        text = "\n".join(self.result_model.diff_lines[row][0] for row in rows)
+        QApplication.clipboard().setText(text)
 
     def show_error(self, error_msg):
         QMessageBox.critical(self, "Ошибка", error_msg)
 
     def cleanup(self):
-        if self.worker_thread:
-            self.worker_thread.quit()
-            self.worker_thread.wait()
-            self.worker_thread = None
-
         self.compare_btn.setEnabled(True)
         self.cancel_btn.setEnabled(False)
         self.progress_bar.hide()
 
     def cancel_operation(self):
-        if self.worker_thread and self.worker_thread.isRunning():
+        if self.worker.is_running():
             self.worker.stop()
-            self.status_label.setText("Отмена операции...")
-            self.cancel_btn.setEnabled(False)
+            self.status_label.setText("Операция отменена")
 
     def closeEvent(self, event):
-        if self.worker_thread and self.worker_thread.isRunning():
-            self.cancel_operation()
-            event.ignore()
-        else:
-            event.accept()
+        # Child processes are terminated right away, so the window can close at once
+        self.cancel_operation()
+        self.worker.shutdown()
+        event.accept()
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     window = PDFComparator()
     window.show()